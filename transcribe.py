@@ -1,5 +1,5 @@
 # transcribe.py
-# Windows-friendly Whisper runner with optional AI post-translation.
+# Windows-friendly Whisper runner (faster-whisper / CTranslate2) with optional AI post-translation.
 #
 # Features:
 # - Prompts once for an OpenAI API key and stores it in "openai_api_key.txt" (gitignored) next to this file.
@@ -17,64 +17,531 @@
 #   Do NOT commit your API key. It is stored locally in openai_api_key.txt, which should be in .gitignore.
 
 import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
 import os
 import re
+import secrets
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from datetime import timedelta
-from typing import List
+from typing import Callable, Dict, List, NamedTuple, Optional
 
-import torch
-import whisper
+import numpy as np
+
+# faster-whisper / CTranslate2 are imported where a model or decoder is needed, so that --help,
+# the daemon client path and the AI step do not pay their start-up cost.
 
 SUPPORTED_LANGS = {"en", "zh", "hi", "es", "ar", "it"}
 KEY_FILENAME = "openai_api_key.txt"  # stored in the project root (same dir as this script)
+AI_MODEL = "gpt-4o-mini"
+# English tokens per translation request. The model's output cap (16k tokens) is the real limit:
+# translations into non-Latin scripts can take ~2x the tokens of the English source.
+AI_CHUNK_TOKENS = 6000
+AI_MAX_CONCURRENCY = 8  # parallel chat requests per transcript (keeps us under TPM limits)
+BATCH_POLL_SECONDS = 30  # how often to check an OpenAI Batch API job
+SAMPLE_RATE = 16000  # Whisper's expected input rate
+WRITE_BUFFER_BYTES = 1 << 20
+MODELS_DIRNAME = "models"  # converted CTranslate2 weights are cached here, next to this script
+AUDIO_CACHE_DIRNAME = "audio_cache"  # decoded 16 kHz PCM (.npy), reused by --cache-audio
+DAEMON_PORT = 50517
+DAEMON_KEY_FILENAME = "daemon_key.txt"  # shared secret for daemon connections (gitignored)
+DAEMON_LOG_FILENAME = "daemon.log"
+DAEMON_IDLE_SECONDS = 30 * 60  # a resident daemon exits after this long without jobs
+DAEMON_START_TIMEOUT = 60
+
+class Segment(NamedTuple):
+    """Backend-neutral subtitle segment (same fields as faster-whisper's segments)."""
+    start: float
+    end: float
+    text: str
+
+@dataclass
+class Transcript:
+    """Whisper output as parallel arrays: segment start/end times (seconds) and stripped segment texts."""
+    starts: np.ndarray
+    ends: np.ndarray
+    texts: List[str]
+
+    @classmethod
+    def from_segments(cls, segments) -> "Transcript":
+        """Collect objects with .start/.end/.text (e.g. a faster-whisper segment generator) in one pass."""
+        starts, ends, texts = [], [], []
+        for seg in segments:
+            starts.append(seg.start)
+            ends.append(seg.end)
+            texts.append(seg.text.strip())
+        return cls(np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64), texts)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __iter__(self):
+        for start, end, text in zip(self.starts.tolist(), self.ends.tolist(), self.texts):
+            yield Segment(start, end, text)
+
+    @property
+    def text(self) -> str:
+        return " ".join(t for t in self.texts if t)
 
 def sanitize_folder_name(name: str) -> str:
     return re.sub(r'[<>:"/\\|?*\x00-\x1F]', '_', name.strip()) or "output"
 
-def ts_srt(seconds: float) -> str:
-    td = timedelta(seconds=max(0, seconds))
-    total = int(td.total_seconds())
-    h, m, s = total // 3600, (total % 3600) // 60, total % 60
-    ms = int((td.total_seconds() - total) * 1000)
-    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
-
-def ts_vtt(seconds: float) -> str:
-    td = timedelta(seconds=max(0, seconds))
-    total = int(td.total_seconds())
-    h, m, s = total // 3600, (total % 3600) // 60, total % 60
-    ms = int((td.total_seconds() - total) * 1000)
-    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+def format_timestamps(seconds: np.ndarray, sep: str) -> List[str]:
+    """Format many times as HH:MM:SS<sep>mmm in one vectorized pass (sep is "," for SRT, "." for VTT)."""
+    # Round to microseconds first, then truncate to milliseconds. Truncating the raw float would turn
+    # e.g. 2544.91 into ...,909 (binary float error); rounding first gives ...,910.
+    total_us = np.rint(np.maximum(seconds, 0) * 1_000_000).astype(np.int64)
+    total_ms = total_us // 1000
+    h = total_ms // 3_600_000
+    m = (total_ms // 60_000) % 60
+    s = (total_ms // 1000) % 60
+    ms = total_ms % 1000
+    fmt = f"%02d:%02d:%02d{sep}%03d"
+    return [fmt % t for t in zip(h.tolist(), m.tolist(), s.tolist(), ms.tolist())]
+
+def open_output(path: Path):
+    """Open an output file for writing with a large buffer, so many small writes become few syscalls."""
+    return path.open("w", encoding="utf-8", buffering=WRITE_BUFFER_BYTES)
 
 def write_txt(path: Path, text: str):
-    path.write_text((text or "").strip() + "\n", encoding="utf-8")
-
-def write_srt(path: Path, segments):
-    lines = []
-    for i, seg in enumerate(segments, start=1):
-        lines.append(f"{i}\n{ts_srt(seg['start'])} --> {ts_srt(seg['end'])}\n{seg['text'].strip()}\n")
-    path.write_text("\n".join(lines).strip() + "\n", encoding="utf-8")
-
-def write_vtt(path: Path, segments):
-    lines = ["WEBVTT\n"]
-    for seg in segments:
-        lines.append(f"{ts_vtt(seg['start'])} --> {ts_vtt(seg['end'])}\n{seg['text'].strip()}\n")
-    path.write_text("\n".join(lines).strip() + "\n", encoding="utf-8")
-
-def chunk_text(text: str, max_chars: int = 8000) -> List[str]:
-    """Split long texts into API-friendly chunks."""
-    text = text.replace("\r\n", "\n")
-    chunks, current, count = [], [], 0
-    for line in text.split("\n"):
-        if count + len(line) + 1 > max_chars and current:
-            chunks.append("\n".join(current))
-            current = [line]
-            count = len(line) + 1
-        else:
-            current.append(line)
-            count += len(line) + 1
+    with open_output(path) as f:
+        f.write((text or "").strip())
+        f.write("\n")
+
+def emit_outputs(paths: Dict[str, Path], transcript: Transcript, text: str, label: str = ""):
+    """Write the requested outputs ({"txt"|"srt"|"vtt": path}) from a single pass over the transcript."""
+    if "txt" in paths:
+        write_txt(paths["txt"], text)
+    with contextlib.ExitStack() as stack:
+        srt_f = stack.enter_context(open_output(paths["srt"])) if "srt" in paths else None
+        vtt_f = stack.enter_context(open_output(paths["vtt"])) if "vtt" in paths else None
+        if srt_f or vtt_f:
+            # One timestamp computation serves both formats; they differ only in the ms separator.
+            starts = format_timestamps(transcript.starts, ",")
+            ends = format_timestamps(transcript.ends, ",")
+            if vtt_f:
+                vtt_f.write("WEBVTT\n")
+            for i, (start, end, seg_text) in enumerate(zip(starts, ends, transcript.texts), start=1):
+                if srt_f:
+                    if i > 1:
+                        srt_f.write("\n")
+                    srt_f.write(f"{i}\n{start} --> {end}\n{seg_text}\n")
+                if vtt_f:
+                    vtt_f.write(f"\n{start.replace(',', '.')} --> {end.replace(',', '.')}\n{seg_text}\n")
+    for fmt, path in paths.items():
+        print(f"[OK] Wrote {fmt.upper()}{label}: {path}")
+
+def stream_outputs(paths: Dict[str, Path], segments, label: str = "") -> str:
+    """Write the requested outputs while consuming segments as they are decoded; returns the full text."""
+    texts = []
+    txt_started = False
+    with contextlib.ExitStack() as stack:
+        # Default (small) buffering here: lines should reach disk soon after they are decoded.
+        files = {fmt: stack.enter_context(path.open("w", encoding="utf-8")) for fmt, path in paths.items()}
+        txt_f, srt_f, vtt_f = files.get("txt"), files.get("srt"), files.get("vtt")
+        if vtt_f:
+            vtt_f.write("WEBVTT\n")
+        for i, seg in enumerate(segments, start=1):
+            seg_text = seg.text.strip()
+            texts.append(seg_text)
+            if txt_f and seg_text:
+                # Same text as Transcript.text: non-empty segments joined by single spaces.
+                txt_f.write(" " + seg_text if txt_started else seg_text)
+                txt_started = True
+            if srt_f or vtt_f:
+                start, end = format_timestamps(np.array((seg.start, seg.end)), ",")
+                if srt_f:
+                    if i > 1:
+                        srt_f.write("\n")
+                    srt_f.write(f"{i}\n{start} --> {end}\n{seg_text}\n")
+                if vtt_f:
+                    vtt_f.write(f"\n{start.replace(',', '.')} --> {end.replace(',', '.')}\n{seg_text}\n")
+        if txt_f:
+            txt_f.write("\n")
+    for fmt, path in paths.items():
+        print(f"[OK] Wrote {fmt.upper()}{label}: {path}")
+    return " ".join(t for t in texts if t)
+
+def decode_media(in_path: Path):
+    """Decode a media file's audio to 16 kHz mono float32, via the ffmpeg CLI if on PATH, else PyAV."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        from faster_whisper.audio import decode_audio
+        return decode_audio(str(in_path), sampling_rate=SAMPLE_RATE)
+    # -vn/-sn/-dn: only the audio stream is demuxed and decoded, so video never costs decode time.
+    cmd = [ffmpeg, "-nostdin", "-loglevel", "error", "-threads", "0", "-i", str(in_path),
+           "-vn", "-sn", "-dn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "pipe:1"]
+    proc = subprocess.run(cmd, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {proc.stderr.decode('utf-8', errors='replace').strip()}")
+    return np.frombuffer(proc.stdout, dtype=np.float32)
+
+def load_or_decode(in_path: Path, cache_dir: Optional[Path] = None):
+    """Decode a media file to 16 kHz mono float32, reusing a cached copy in cache_dir when the file is unchanged."""
+    if cache_dir is None:
+        return decode_media(in_path)
+
+    st = in_path.stat()
+    digest = hashlib.sha1(f"{in_path}|{st.st_mtime_ns}|{st.st_size}".encode("utf-8")).hexdigest()[:16]
+    cache_file = cache_dir / f"{sanitize_folder_name(in_path.stem)}.{digest}.npy"
+    if cache_file.exists():
+        return np.load(cache_file, mmap_mode="r")
+
+    audio = decode_media(in_path)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    with tmp_file.open("wb") as f:
+        np.save(f, audio)
+    os.replace(tmp_file, cache_file)  # never leave a half-written cache entry behind
+    return audio
+
+def iter_decoded_audio(paths: List[Path], cache_dir: Optional[Path] = None):
+    """Yield (path, audio) pairs, decoding the next file in the background while the caller runs the model."""
+    if not paths:
+        return
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        upcoming = pool.submit(load_or_decode, paths[0], cache_dir)
+        for i, path in enumerate(paths):
+            current = upcoming
+            if i + 1 < len(paths):
+                upcoming = pool.submit(load_or_decode, paths[i + 1], cache_dir)
+            try:
+                audio = current.result()
+            except Exception as e:
+                print(f"[ERROR] Could not decode audio from {path}: {e}")
+                continue
+            yield path, audio
+
+def load_onnx_pipeline(model_size: str, device: str, models_dir: Path):
+    """Export Whisper to ONNX once (with fused-attention graph optimizations) and load it as an ORT ASR pipeline."""
+    try:
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq, ORTOptimizer
+        from optimum.onnxruntime.configuration import OptimizationConfig
+        from optimum.pipelines import pipeline
+        from transformers import AutoProcessor
+    except Exception as e:
+        raise RuntimeError("ONNX backend not available. Install 'optimum[onnxruntime]' "
+                           "(or 'optimum[onnxruntime-gpu]' for CUDA).") from e
+
+    model_id = f"openai/whisper-{model_size}"
+    onnx_dir = models_dir / f"whisper-{model_size}-onnx"
+    if not (onnx_dir / "preprocessor_config.json").exists():
+        print(f"[SETUP] Exporting {model_id} to ONNX: {onnx_dir}")
+        exported = ORTModelForSpeechSeq2Seq.from_pretrained(model_id, export=True)
+        # Level 2 fuses QKV MatMuls / attention and uses memory-efficient attention for past state.
+        ORTOptimizer.from_pretrained(exported).optimize(
+            save_dir=onnx_dir,
+            optimization_config=OptimizationConfig(
+                optimization_level=2,
+                optimize_for_gpu=device == "cuda",
+                enable_transformers_specific_optimizations=True,
+            ),
+        )
+        AutoProcessor.from_pretrained(model_id).save_pretrained(onnx_dir)  # written last: marks the export complete
+
+    provider = {"cuda": "CUDAExecutionProvider", "coreml": "CoreMLExecutionProvider"}.get(device, "CPUExecutionProvider")
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(onnx_dir, provider=provider)
+    processor = AutoProcessor.from_pretrained(onnx_dir)
+    return pipeline("automatic-speech-recognition", model=model, accelerator="ort",
+                    tokenizer=processor.tokenizer, feature_extractor=processor.feature_extractor)
+
+def transcribe_onnx(pipe, audio, mode: str, in_lang: str, batch_size: int = 8, beam_size: int = 1) -> Transcript:
+    """Run the ORT pipeline over 30 s windows and convert its timestamped chunks to a transcript."""
+    result = pipe({"raw": audio, "sampling_rate": SAMPLE_RATE}, return_timestamps=True,
+                  chunk_length_s=30, batch_size=batch_size,
+                  generate_kwargs={"language": in_lang, "task": mode, "num_beams": beam_size})
+    segments = []
+    for ch in result.get("chunks", []):
+        start, end = ch["timestamp"]
+        start = start or 0.0
+        segments.append(Segment(start, end if end is not None else start, ch["text"]))
+    return Transcript.from_segments(segments)
+
+def select_device(requested: str, backend: str) -> str:
+    """Resolve --device "auto": CUDA when a GPU is visible (and, for ONNX, onnxruntime has the CUDA provider),
+    else Core ML for ONNX on Apple Silicon, else CPU."""
+    import ctranslate2
+
+    if requested != "auto":
+        return requested
+    has_gpu = ctranslate2.get_cuda_device_count() > 0
+    if backend != "onnx":
+        return "cuda" if has_gpu else "cpu"
+    try:
+        import onnxruntime
+        providers = onnxruntime.get_available_providers()
+    except Exception:
+        providers = []
+    if has_gpu and "CUDAExecutionProvider" in providers:
+        return "cuda"
+    if "CoreMLExecutionProvider" in providers:
+        return "coreml"
+    return "cpu"
+
+def cuda_device_index(device: str, gpus: int):
+    """WhisperModel device_index: the first `gpus` CUDA devices as a list when more than one is asked for, else 0."""
+    import ctranslate2
+
+    if device != "cuda" or gpus <= 1:
+        return 0
+    return list(range(min(gpus, ctranslate2.get_cuda_device_count())))
+
+def load_engine(backend: str, model_size: str, device: str, compute_type: str, models_dir: Path,
+                workers: int = 1, gpus: int = 1):
+    """Load the Whisper model for a backend; the result is what run_engine() expects.
+
+    For CTranslate2, workers is the number of concurrent transcribe() calls per replica, and gpus the
+    number of CUDA devices that get a replica.
+    """
+    try:
+        from faster_whisper import BatchedInferencePipeline, WhisperModel
+    except Exception as e:
+        raise RuntimeError("faster-whisper not available. Ensure 'faster-whisper' is in requirements.txt.") from e
+
+    device = select_device(device, backend)
+    print(f"[INFO] Loading model: {model_size}")
+    if backend == "onnx":
+        print(f"[INFO] Using device: {device} (ONNX Runtime)")
+        return load_onnx_pipeline(model_size, device, models_dir)
+    if compute_type == "auto":
+        compute_type = "int8_float16" if device == "cuda" else "int8"
+    device_index = cuda_device_index(device, gpus)
+    print(f"[INFO] Using device: {device} {device_index} ({compute_type}, {workers} worker(s))")
+    model = WhisperModel(model_size, device=device, device_index=device_index, compute_type=compute_type,
+                         num_workers=workers, download_root=str(models_dir))
+    return BatchedInferencePipeline(model=model)
+
+def run_engine(engine, job: dict, audio, stream: bool = False):
+    """Run one decoded audio array through a loaded engine with the job's backend/mode/in_lang/batch_size.
+
+    Returns a Transcript, or with stream=True (CTranslate2 backend) the lazy segment generator itself.
+    """
+    if job["backend"] == "onnx":
+        return transcribe_onnx(engine, audio, job["mode"], job["in_lang"], batch_size=job["batch_size"],
+                               beam_size=job["beam_size"])
+    # Silero VAD drops silence and splits speech into <=30 s chunks, which are decoded
+    # batch_size at a time; segment times are mapped back to the original audio.
+    # without_timestamps=False: the batched pipeline defaults to True, which yields one segment per
+    # VAD chunk (up to 30 s); Whisper's timestamp tokens split chunks into sentence-level cues instead.
+    # beam_size defaults to 1 (greedy) here instead of faster-whisper's 5.
+    segments, info = engine.transcribe(audio, task=job["mode"], language=job["in_lang"],
+                                       batch_size=job["batch_size"], vad_filter=True, chunk_length=30,
+                                       without_timestamps=False, beam_size=job["beam_size"])
+    if stream:
+        return segments
+    # The pipeline yields lazily; inference runs here.
+    return Transcript.from_segments(segments)
+
+def daemon_authkey(project_dir: Path) -> bytes:
+    """Return the daemon's shared secret, creating it next to this script on first use."""
+    key_path = project_dir / DAEMON_KEY_FILENAME
+    # Owner-only permissions: an authenticated client can make the daemon unpickle arbitrary objects.
+    # (POSIX only; on Windows the mode is ignored and the file inherits the project folder's ACL.)
+    try:
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(secrets.token_hex(16))
+    return key_path.read_text(encoding="utf-8").strip().encode("ascii")
+
+def serve_daemon(port: int, project_dir: Path, idle_seconds: int = DAEMON_IDLE_SECONDS):
+    """Keep models resident and serve transcription jobs from local clients, one thread per job."""
+    from multiprocessing.connection import AuthenticationError, Listener
+
+    engines = {}
+    engines_lock = threading.Lock()
+    state = {"active": 0, "last_job": time.monotonic()}
+    state_lock = threading.Lock()
+
+    def get_engine(job: dict):
+        key = (job["backend"], job["model"], job["device"], job["compute_type"], job["workers"], job["gpus"])
+        with engines_lock:
+            if key not in engines:
+                engines[key] = load_engine(job["backend"], job["model"], job["device"], job["compute_type"],
+                                           project_dir / MODELS_DIRNAME, workers=job["workers"], gpus=job["gpus"])
+            return engines[key]
+
+    def handle(conn):
+        try:
+            with conn:
+                job = conn.recv()
+                print(f"[INFO] Job: {job['path']} ({job['mode']}, {job['model']})")
+                try:
+                    engine = get_engine(job)
+                    cache_dir = project_dir / AUDIO_CACHE_DIRNAME if job["cache_audio"] else None
+                    audio = load_or_decode(Path(job["path"]), cache_dir)
+                    reply = {"ok": True, "transcript": run_engine(engine, job, audio)}
+                except Exception as e:
+                    print(f"[ERROR] Job failed: {e}")
+                    reply = {"ok": False, "error": str(e)}
+                conn.send(reply)
+        except (EOFError, OSError) as e:
+            print(f"[WARN] Client connection lost: {e}")
+        finally:
+            with state_lock:
+                state["active"] -= 1
+                state["last_job"] = time.monotonic()
+
+    def exit_when_idle():
+        while True:
+            time.sleep(30)
+            with state_lock:
+                idle = state["active"] == 0 and time.monotonic() - state["last_job"] > idle_seconds
+            if idle:
+                print(f"[INFO] No jobs for {idle_seconds} s; daemon exiting.")
+                os._exit(0)
+
+    with Listener(("127.0.0.1", port), authkey=daemon_authkey(project_dir)) as listener:
+        print(f"[INFO] Daemon listening on 127.0.0.1:{port}")
+        threading.Thread(target=exit_when_idle, daemon=True).start()
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                print(f"[WARN] Rejected connection: {e}")
+                continue
+            with state_lock:
+                state["active"] += 1
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+def spawn_daemon(port: int, project_dir: Path):
+    """Start a detached daemon process that logs to daemon.log next to this script."""
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    with open(project_dir / DAEMON_LOG_FILENAME, "a", encoding="utf-8") as log:
+        subprocess.Popen([sys.executable, "-u", str(Path(__file__).resolve()), "--daemon", "--daemon-port", str(port)],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                         cwd=str(project_dir), **kwargs)
+
+def connect_daemon(port: int, project_dir: Path):
+    """Connect to the local daemon, starting one and waiting for it if nothing is listening."""
+    from multiprocessing.connection import AuthenticationError, Client
+
+    address, authkey = ("127.0.0.1", port), daemon_authkey(project_dir)
+
+    def connect():
+        try:
+            return Client(address, authkey=authkey)
+        except AuthenticationError as e:
+            raise RuntimeError(f"A daemon with a different key (e.g. from before {DAEMON_KEY_FILENAME} was "
+                               f"deleted) is running on 127.0.0.1:{port}. Stop that process, or use another "
+                               f"--daemon-port.") from e
+
+    try:
+        return connect()
+    except ConnectionRefusedError:
+        pass
+    print(f"[INFO] Starting daemon on 127.0.0.1:{port} (log: {project_dir / DAEMON_LOG_FILENAME})")
+    spawn_daemon(port, project_dir)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while True:
+        time.sleep(0.5)
+        try:
+            return connect()
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Daemon did not start within {DAEMON_START_TIMEOUT} s; "
+                                   f"see {project_dir / DAEMON_LOG_FILENAME}")
+
+def iter_daemon_transcripts(paths: List[Path], job: dict, port: int, project_dir: Path):
+    """Yield (path, transcript) pairs, sending each file to the resident daemon."""
+    for path in paths:
+        print(f"[INFO] Processing (daemon): {path}")
+        with connect_daemon(port, project_dir) as conn:
+            conn.send({**job, "path": str(path)})
+            reply = conn.recv()
+        if not reply["ok"]:
+            print(f"[ERROR] Daemon failed on {path}: {reply['error']}")
+            continue
+        yield path, reply["transcript"]
+
+def iter_local_transcripts(paths: List[Path], job: dict, project_dir: Path, stream: bool = False):
+    """Yield (path, transcript) pairs, loading the model in this process (see run_engine for stream).
+
+    With CTranslate2, workers x GPU replicas files are transcribed concurrently; results are still
+    yielded in input order, and stream is ignored in that case.
+    """
+    device = select_device(job["device"], job["backend"])
+    workers, gpus = (job["workers"], job["gpus"]) if job["backend"] == "ctranslate2" else (1, 1)
+    device_index = cuda_device_index(device, gpus)
+    concurrency = workers * (len(device_index) if isinstance(device_index, list) else 1)
+    engine = load_engine(job["backend"], job["model"], device, job["compute_type"],
+                         project_dir / MODELS_DIRNAME, workers=workers, gpus=gpus)
+    cache_dir = project_dir / AUDIO_CACHE_DIRNAME if job["cache_audio"] else None
+    if concurrency <= 1:
+        for path, audio in iter_decoded_audio(paths, cache_dir):
+            print(f"[INFO] Processing: {path}")
+            yield path, run_engine(engine, job, audio, stream=stream)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = deque()
+        for path, audio in iter_decoded_audio(paths, cache_dir):
+            print(f"[INFO] Processing: {path}")
+            in_flight.append((path, pool.submit(run_engine, engine, job, audio)))
+            if len(in_flight) >= concurrency:
+                done_path, fut = in_flight.popleft()
+                yield done_path, fut.result()
+        while in_flight:
+            done_path, fut = in_flight.popleft()
+            yield done_path, fut.result()
+
+def pack_sentences(line: str, max_size: int, measure: Callable[[str], int]) -> List[str]:
+    """Split one over-long line after sentence-ending punctuation and pack the sentences into chunks."""
+    chunks, current, size = [], [], 0
+    for sentence in re.split(r"(?<=[.!?\u3002\uff01\uff1f])\s+", line):
+        sentence_size = measure(sentence) + 1
+        if size + sentence_size > max_size and current:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += sentence_size
     if current:
-        chunks.append("\n".join(current))
+        chunks.append(" ".join(current))
+    return chunks
+
+def chunk_text(text: str, max_size: int = 8000, size_of: Optional[Callable[[str], int]] = None) -> List[str]:
+    """Split long texts into API-friendly chunks of at most max_size characters (or size_of() units, e.g. tokens).
+
+    Chunks break at line boundaries in a single scan. A line too big on its own (Whisper's text is
+    usually one long line) is split at sentence ends instead.
+    """
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    chunks = []
+    start = pos = size = 0  # current chunk is text[start:pos] and measures `size`; pos starts the next line
+    while True:
+        nl = text.find("\n", pos)
+        line_end = len(text) if nl == -1 else nl
+        # Each line costs its size + 1 (newline); flush before a line that would overflow the chunk.
+        line_size = (line_end - pos if size_of is None else size_of(text[pos:line_end])) + 1
+        if size + line_size > max_size and pos > start:
+            chunks.append(text[start:pos - 1])
+            start, size = pos, 0
+        if line_size > max_size:
+            chunks.extend(pack_sentences(text[pos:line_end], max_size, size_of or len))
+            start = line_end + 1
+        else:
+            size += line_size
+        if nl == -1:
+            break
+        pos = nl + 1
+    if start <= len(text):
+        chunks.append(text[start:])
     return chunks
 
 def ensure_openai_api_key(project_dir: Path) -> str:
@@ -100,39 +567,119 @@ def ensure_openai_api_key(project_dir: Path) -> str:
                 print("[WARN] Invalid key. Try again (must start with 'sk-').")
     return key
 
-def ai_translate_english_to_target(english_text: str, target_lang_code: str, api_key: str) -> str:
-    """AI translation from English to the target language using OpenAI."""
+def run_openai_batch(client, bodies: List[dict]) -> List[str]:
+    """Submit chat-completion bodies as one OpenAI Batch API job, wait for it, return contents in input order."""
+    jsonl = "\n".join(
+        json.dumps({"custom_id": f"chunk-{i}", "method": "POST", "url": "/v1/chat/completions", "body": body})
+        for i, body in enumerate(bodies)
+    )
+    batch_file = client.files.create(file=("translate.jsonl", jsonl.encode("utf-8")), purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                  completion_window="24h")
+    print(f"[INFO] Submitted OpenAI batch {batch.id} ({len(bodies)} chunks); waiting for completion...")
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+        print(f"[INFO] Batch {batch.id}: {batch.status}")
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"OpenAI batch {batch.id} ended with status '{batch.status}'.")
+
+    outputs = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") != 200:
+            raise RuntimeError(f"Batch request {item.get('custom_id')} failed: {item.get('error') or response}")
+        outputs[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    missing = [f"chunk-{i}" for i in range(len(bodies)) if f"chunk-{i}" not in outputs]
+    if missing:
+        raise RuntimeError(f"OpenAI batch {batch.id} returned no output for: {', '.join(missing)}")
+    return [outputs[f"chunk-{i}"] for i in range(len(bodies))]
+
+async def run_openai_concurrent(client, bodies: List[dict], max_concurrency: int = AI_MAX_CONCURRENCY) -> List[str]:
+    """Send chat-completion bodies concurrently (at most max_concurrency in flight); return contents in input order."""
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def complete(body: dict) -> str:
+        parts = []
+        async with sem:
+            stream = await client.chat.completions.create(**body, stream=True)
+            async for event in stream:
+                if not event.choices:
+                    continue
+                choice = event.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                if choice.finish_reason == "length":
+                    print("[WARN] AI translation hit the output token limit; a chunk may be truncated.")
+        return "".join(parts)
+
+    async with client:
+        return await asyncio.gather(*(complete(body) for body in bodies))
+
+def ai_translate_english_to_target(english_text: str, target_lang_code: str, api_key: str,
+                                   use_batch: bool = False) -> str:
+    """AI translation from English to the target language using OpenAI.
+
+    With use_batch, transcripts of more than two chunks go through the Batch API (about half the cost,
+    but results can take minutes to hours); otherwise all chunks are requested concurrently.
+    """
     try:
-        from openai import OpenAI
+        from openai import AsyncOpenAI, OpenAI
     except Exception as e:
         raise RuntimeError("OpenAI SDK not available. Ensure 'openai' is in requirements.txt.") from e
 
-    client = OpenAI(api_key=api_key)
-
     system_prompt = (
         "You are a professional translator. Translate the following English text into the target language "
         "while preserving meaning, tone, names, numbers, and formatting. Use natural, fluent prose."
     )
 
-    chunks = chunk_text(english_text, max_chars=8000)
-    outputs = []
-
-    for ch in chunks:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(AI_MODEL)
+        chunks = chunk_text(english_text, AI_CHUNK_TOKENS, size_of=lambda piece: len(encoding.encode(piece)))
+    except (ImportError, KeyError):
+        chunks = chunk_text(english_text, max_size=8000)  # tiktoken unavailable: characters as a proxy
+    bodies = [
+        dict(
+            model=AI_MODEL,
             temperature=0.2,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Target language code: {target_lang_code}\n\nText:\n{ch}"}
             ],
         )
-        outputs.append(resp.choices[0].message.content.strip())
-
-    return "\n".join(outputs).strip()
+        for ch in chunks
+    ]
+
+    if use_batch and len(bodies) > 2:
+        contents = run_openai_batch(OpenAI(api_key=api_key), bodies)
+    else:
+        contents = asyncio.run(run_openai_concurrent(AsyncOpenAI(api_key=api_key), bodies))
+
+    return "\n".join(c.strip() for c in contents).strip()
+
+def write_translations(pending: list, out_lang: str, wait: bool = False) -> list:
+    """Write finished step-2 translations from (future, path) pairs; returns the ones still running."""
+    running = []
+    for fut, out_path in pending:
+        if not wait and not fut.done():
+            running.append((fut, out_path))
+            continue
+        try:
+            write_txt(out_path, fut.result())
+            print(f"[OK] Wrote TXT ({out_lang}): {out_path}")
+            print("[INFO] Note: SRT/VTT remain in English from step 1. "
+                  "Ask if you want target-language SRT/VTT with per-segment alignment.")
+        except Exception as e:
+            print(f"[ERROR] AI translation failed: {e}")
+    return running
 
 def main():
     ap = argparse.ArgumentParser(description="Transcribe/translate audio/video using Whisper + AI post-translation.")
-    ap.add_argument("inputs", nargs="+", help="Audio/Video file paths.")
+    ap.add_argument("inputs", nargs="*", help="Audio/Video file paths.")
     ap.add_argument("--model", default="small",
                     choices=["tiny", "base", "small", "medium", "large-v3"],
                     help="Whisper model size (default: small).")
@@ -142,87 +689,130 @@ def main():
                     help="Input language code (en, zh, hi, es, ar, it).")
     ap.add_argument("--out-lang", default="it",
                     help="Output language code (en, zh, hi, es, ar, it).")
+    ap.add_argument("--backend", default="ctranslate2", choices=["ctranslate2", "onnx"],
+                    help="Inference backend: faster-whisper/CTranslate2 (default) or ONNX Runtime via optimum.")
+    ap.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"],
+                    help="Where to run the model (default: auto = CUDA if available; "
+                         "Core ML on Apple Silicon with --backend onnx; else CPU).")
+    ap.add_argument("--compute-type", default="auto",
+                    choices=["auto", "int8_float16", "int8", "float16", "float32"],
+                    help="CTranslate2 weight precision (default: auto = int8_float16 on GPU, int8 on CPU).")
+    ap.add_argument("--beam-size", type=int, default=1,
+                    help="Beam search width (default: 1 = greedy, fastest; 5 is slower and slightly more accurate).")
+    ap.add_argument("--batch-size", type=int, default=16,
+                    help="Speech chunks (up to 30 s each) decoded in parallel per file (default: 16). "
+                         "Lower it if you run out of GPU memory.")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Files transcribed concurrently per model copy by the CTranslate2 backend (default: 1). "
+                         "2 keeps the GPU busier on multi-file runs.")
+    ap.add_argument("--gpus", type=int, default=1,
+                    help="CUDA devices to load a model copy on, CTranslate2 backend only (default: 1). "
+                         "Files are spread over all copies.")
+    ap.add_argument("--cache-audio", action="store_true",
+                    help=f"Keep decoded audio in '{AUDIO_CACHE_DIRNAME}/' so re-runs on the same file skip FFmpeg.")
+    ap.add_argument("--stream", action="store_true",
+                    help="Write TXT/SRT/VTT while segments are decoded instead of after the whole file.")
+    ap.add_argument("--ai-batch", action="store_true",
+                    help="Send long step-2 translations through the OpenAI Batch API "
+                         "(about half the cost, but may take minutes to hours).")
+    ap.add_argument("--use-daemon", action="store_true",
+                    help="Send files to a resident background process that keeps the model loaded "
+                         "(started automatically if not running).")
+    ap.add_argument("--daemon", action="store_true",
+                    help="Run as the resident model daemon (used by --use-daemon).")
+    ap.add_argument("--daemon-port", type=int, default=DAEMON_PORT,
+                    help=f"Local TCP port for the daemon (default: {DAEMON_PORT}).")
     args = ap.parse_args()
 
     project_dir = Path(__file__).resolve().parent
 
+    if args.daemon:
+        serve_daemon(args.daemon_port, project_dir)
+        return
+    if not args.inputs:
+        ap.error("at least one input file is required")
+
     # Ensure API key file exists (even if this run may not need it)
     api_key = ensure_openai_api_key(project_dir)
 
     in_lang = args.in_lang if args.in_lang in SUPPORTED_LANGS else "it"
     out_lang = args.out_lang if args.out_lang in SUPPORTED_LANGS else in_lang
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"[INFO] Using device: {device}")
-    print(f"[INFO] Loading model: {args.model}")
-    model = whisper.load_model(args.model, device=device)
-
     requested = {t.strip().lower() for t in args.outputs.split(",") if t.strip()}
     valid = {"txt", "srt", "vtt"}
     targets = list(requested & valid) or ["txt"]
 
+    in_paths = []
     for inp in args.inputs:
         in_path = Path(inp).resolve()
         if not in_path.exists() or not in_path.is_file():
             print(f"[ERROR] File not found: {in_path}")
             continue
-
-        name = sanitize_folder_name(in_path.stem)
-        out_dir = project_dir / name
-        out_dir.mkdir(parents=True, exist_ok=True)
-
-        # Step 1: decide mode
-        if out_lang == in_lang:
-            mode = "transcribe"
-            print(f"[INFO] Mode: TRANSCRIBE in '{in_lang}'")
-        elif out_lang == "en":
-            mode = "translate"  # to English
-            print("[INFO] Mode: TRANSLATE Whisper -> English (step 1)")
-        else:
-            mode = "translate"  # then AI EN -> target
-            print("[INFO] Mode: TRANSLATE Whisper -> English (step 1), then AI EN -> target (step 2)")
-
-        print(f"[INFO] Processing: {in_path}")
-        tr_kwargs = dict(task=mode, verbose=False, language=in_lang)
-        result = model.transcribe(str(in_path), **tr_kwargs)
-
-        text = (result.get("text") or "").strip()
-        segments = result.get("segments", [])
-
-        # Step 1 outputs
-        if mode == "transcribe":
-            if "txt" in targets:
-                write_txt(out_dir / f"{name} [{in_lang}].txt", text)
-                print(f"[OK] Wrote TXT: {out_dir / f'{name} [{in_lang}].txt'}")
-            if "srt" in targets:
-                write_srt(out_dir / f"{name}.srt", segments)
-                print(f"[OK] Wrote SRT: {out_dir / f'{name}.srt'}")
-            if "vtt" in targets:
-                write_vtt(out_dir / f"{name}.vtt", segments)
-                print(f"[OK] Wrote VTT: {out_dir / f'{name}.vtt'}")
-
-        else:
-            if "txt" in targets:
-                write_txt(out_dir / f"{name} [eng].txt", text)
-                print(f"[OK] Wrote TXT (EN): {out_dir / f'{name} [eng].txt'}")
-            if "srt" in targets:
-                write_srt(out_dir / f"{name} [eng].srt", segments)
-                print(f"[OK] Wrote SRT (EN): {out_dir / f'{name} [eng].srt'}")
-            if "vtt" in targets:
-                write_vtt(out_dir / f"{name} [eng].vtt", segments)
-                print(f"[OK] Wrote VTT (EN): {out_dir / f'{name} [eng].vtt'}")
-
-            # Step 2: AI EN -> target (only if target != en and != input)
-            if out_lang != "en" and out_lang != in_lang:
-                try:
-                    print(f"[INFO] AI translating English -> '{out_lang}' (step 2)")
-                    translated = ai_translate_english_to_target(text, out_lang, api_key)
-                    write_txt(out_dir / f"{name} [{out_lang}].txt", translated)
-                    print(f"[OK] Wrote TXT ({out_lang}): {out_dir / f'{name} [{out_lang}].txt'}")
-                    print("[INFO] Note: SRT/VTT remain in English from step 1. "
-                          "Ask if you want target-language SRT/VTT with per-segment alignment.")
-                except Exception as e:
-                    print(f"[ERROR] AI translation failed: {e}")
+        in_paths.append(in_path)
+
+    # Step 1: decide mode
+    if out_lang == in_lang:
+        mode = "transcribe"
+        print(f"[INFO] Mode: TRANSCRIBE in '{in_lang}'")
+    elif out_lang == "en":
+        mode = "translate"  # to English
+        print("[INFO] Mode: TRANSLATE Whisper -> English (step 1)")
+    else:
+        mode = "translate"  # then AI EN -> target
+        print("[INFO] Mode: TRANSLATE Whisper -> English (step 1), then AI EN -> target (step 2)")
+
+    job = dict(backend=args.backend, model=args.model, device=args.device, compute_type=args.compute_type,
+               mode=mode, in_lang=in_lang, batch_size=args.batch_size, cache_audio=args.cache_audio,
+               workers=max(1, args.workers), gpus=max(1, args.gpus), beam_size=max(1, args.beam_size))
+    if args.stream:
+        if args.use_daemon:
+            print("[WARN] --stream has no effect with --use-daemon: the daemon returns each file's "
+                  "transcript when it is complete.")
+        elif args.backend == "onnx":
+            print("[WARN] --stream has no effect with --backend onnx: the ONNX pipeline returns whole files.")
+        elif args.workers > 1 or args.gpus > 1:
+            print("[WARN] --stream has no effect with --workers/--gpus above 1: "
+                  "concurrent files are written once each is complete.")
+    if args.use_daemon:
+        transcripts = iter_daemon_transcripts(in_paths, job, args.daemon_port, project_dir)
+    else:
+        transcripts = iter_local_transcripts(in_paths, job, project_dir, stream=args.stream)
+
+    # Step 2 runs on a worker thread so the next file's transcription overlaps the OpenAI round-trips.
+    pending = []  # (future, output path) of translations not written yet
+    with ThreadPoolExecutor(max_workers=1) as translator:
+        try:
+            for in_path, transcript in transcripts:
+                name = sanitize_folder_name(in_path.stem)
+                out_dir = project_dir / name
+                out_dir.mkdir(parents=True, exist_ok=True)
+
+                # Step 1 outputs
+                if mode == "transcribe":
+                    out_paths = {"txt": out_dir / f"{name} [{in_lang}].txt",
+                                 "srt": out_dir / f"{name}.srt",
+                                 "vtt": out_dir / f"{name}.vtt"}
+                    label = ""
+                else:
+                    out_paths = {fmt: out_dir / f"{name} [eng].{fmt}" for fmt in valid}
+                    label = " (EN)"
+                selected = {fmt: p for fmt, p in out_paths.items() if fmt in targets}
+                if args.stream:
+                    text = stream_outputs(selected, transcript, label)
+                else:
+                    text = transcript.text
+                    emit_outputs(selected, transcript, text, label)
+
+                # Step 2: AI EN -> target (only if target != en and != input)
+                if out_lang != "en" and out_lang != in_lang:
+                    print(f"[INFO] AI translating English -> '{out_lang}' (step 2, in background)")
+                    fut = translator.submit(ai_translate_english_to_target, text, out_lang, api_key,
+                                            use_batch=args.ai_batch)
+                    pending.append((fut, out_dir / f"{name} [{out_lang}].txt"))
+                pending = write_translations(pending, out_lang)
+        finally:
+            # Also on errors: translations already paid for must still reach disk.
+            write_translations(pending, out_lang, wait=True)
 
     print("[DONE] All files processed.")
 